@@ -2,10 +2,16 @@
 
 """CREEDS Analysis."""
 
+import functools
+import json
+import math
+import os
 import pickle
 import logging
+import sys
 from collections import defaultdict
-from typing import Optional, Type
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Type
 
 import bioregistry
 import bioversions
@@ -17,23 +23,49 @@ import pystow
 import seaborn
 from indra.sources import creeds
 from indra.statements import Agent, RegulateAmount, Statement, stmts_to_json_file
-from scipy.stats import fisher_exact
-from statsmodels.stats.multitest import multipletests
+from numba import njit, prange
+from scipy.cluster.hierarchy import linkage
 from tqdm import tqdm
 
 import pybiopax
-from pybiopax.biopax import Protein
+from pybiopax.biopax import BioPaxModel, Protein
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 logger = logging.getLogger(__name__)
 
-REACTOME_MODULE = pystow.module("bio", "reactome", bioversions.get_version("reactome"))
 CREEDS_MODULE = pystow.module("bio", "creeds")
 
+# There are only a handful of distinct xref databases and UniProt identifiers
+# recur across many Reactome pathways, so memoize these lookups
+_norm_prefix = functools.lru_cache(maxsize=None)(bioregistry.normalize_prefix)
+_uniprot_to_hgnc = functools.lru_cache(maxsize=None)(protmapper.uniprot_client.get_hgnc_id)
+
+
+@functools.lru_cache(maxsize=None)
+def _reactome_module() -> pystow.Module:
+    """Get the versioned Reactome module, looking up the version on first use.
+
+    Getting the current Reactome version requires a network call, so it is
+    deferred until needed rather than done at import time.
+    """
+    return pystow.module("bio", "reactome", bioversions.get_version("reactome"))
+
 
 def get_reactome_human_ids() -> set[str]:
-    identifiers = pyobo.get_ids("reactome")
+    path = _reactome_module().join(name="human_ids.json")
+    if path.is_file():
+        with path.open() as file:
+            return set(json.load(file))
     species = pyobo.get_id_species_mapping("reactome")
-    rv = {reactome_id for reactome_id in identifiers if species[reactome_id] == "9606"}
+    rv = {reactome_id for reactome_id, taxonomy_id in species.items() if taxonomy_id == "9606"}
+    with path.open("w") as file:
+        json.dump(sorted(rv), file)
     return rv
 
 
@@ -41,41 +73,59 @@ def get_protein_hgnc(protein: Protein) -> Optional[str]:
     # only useful for reactome
     if protein.entity_reference is None:
         return None
-    rv = {bioregistry.normalize_prefix(xref.db): xref.id for xref in protein.entity_reference.xref}
-    hgnc_id = rv.get("hgnc")
-    if hgnc_id is not None:
-        return hgnc_id
-    uniprot_id = rv.get("uniprot")
+    # Scan the xrefs once, returning as soon as an HGNC xref is found
+    uniprot_id = uniprot_isoform_id = None
+    for xref in protein.entity_reference.xref:
+        prefix = _norm_prefix(xref.db)
+        if prefix == "hgnc":
+            return xref.id
+        elif prefix == "uniprot" and uniprot_id is None:
+            uniprot_id = xref.id
+        elif prefix == "uniprot.isoform" and uniprot_isoform_id is None:
+            uniprot_isoform_id = xref.id
     if uniprot_id is not None:
-        hgnc_id = protmapper.uniprot_client.get_hgnc_id(uniprot_id)
+        hgnc_id = _uniprot_to_hgnc(uniprot_id)
         if hgnc_id:
             return hgnc_id
-    uniprot_isoform_id = rv.get("uniprot.isoform")
     if uniprot_isoform_id is not None:
-        hgnc_id = protmapper.uniprot_client.get_hgnc_id(uniprot_isoform_id)
+        hgnc_id = _uniprot_to_hgnc(uniprot_isoform_id)
         if hgnc_id:
             return hgnc_id
     return None
 
 
 def ensure_reactome(reactome_id: str, force: bool = False) -> BioPaxModel:
-    path = REACTOME_MODULE.join(name=f"{reactome_id}.xml")
+    path = _reactome_module().join(name=f"{reactome_id}.xml")
     if path.is_file() and not force:
         with path.open("rb") as file:
             return pickle.load(file)
     logger.info(f'Getting {reactome_id}')
     model = pybiopax.model_from_reactome(reactome_id)
-    with path.open("wb") as file:
-        pickle.dump(model, file)
+    # Write to a temporary file first so concurrent readers never see a partial pickle
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("wb") as file:
+        pickle.dump(model, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
     return model
 
 
 def get_reactome_genes(reactome_id: str) -> set[str]:
+    # Only the gene set is needed downstream, so cache it separately from
+    # the full model to avoid unpickling the model on subsequent runs
+    path = _reactome_module().join(name=f"{reactome_id}.genes.json")
+    if path.is_file():
+        with path.open() as file:
+            return {sys.intern(hgnc_id) for hgnc_id in json.load(file)}
     model = ensure_reactome(reactome_id)
     rv = set()
     for protein in model.get_objects_by_type(Protein):
         if (hgnc_id := get_protein_hgnc(protein)) is not None:
-            rv.add(hgnc_id)
+            # Intern since the same identifiers recur across many gene sets
+            rv.add(sys.intern(hgnc_id))
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w") as file:
+        json.dump(sorted(rv), file)
+    os.replace(tmp_path, path)
     return rv
 
 
@@ -100,7 +150,7 @@ def get_hgnc_id(agent: Agent) -> Optional[str]:
     up_id = agent.db_refs.get("UP")
     if up_id is None:
         return None
-    return protmapper.uniprot_client.get_hgnc_id(up_id)
+    return _uniprot_to_hgnc(up_id)
 
 
 def get_regulates(
@@ -115,7 +165,7 @@ def get_regulates(
         obj_hgnc_id = get_hgnc_id(stmt.obj)
         if subj_hgnc_id is None or obj_hgnc_id is None:
             continue
-        rv[subj_hgnc_id].add(obj_hgnc_id)
+        rv[subj_hgnc_id].add(sys.intern(obj_hgnc_id))
     return dict(rv)
 
 
@@ -131,7 +181,7 @@ def get_disease_groups(
         obj_hgnc_id = get_hgnc_id(stmt.obj)
         if subj_doid is None or obj_hgnc_id is None:
             continue
-        rv[subj_doid].add(obj_hgnc_id)
+        rv[subj_doid].add(sys.intern(obj_hgnc_id))
     return dict(rv)
 
 
@@ -147,42 +197,175 @@ def get_chemical_groups(
         obj_hgnc_id = get_hgnc_id(stmt.obj)
         if subj_pubchem is None or obj_hgnc_id is None:
             continue
-        rv[subj_pubchem].add(obj_hgnc_id)
+        rv[subj_pubchem].add(sys.intern(obj_hgnc_id))
     return dict(rv)
 
 
-def _prepare_hypergeometric_test(
-    query_gene_set: set[str],
-    pathway_gene_set: set[str],
+def _get_gene_index(gene_sets: Iterable[Iterable[str]]) -> dict[str, int]:
+    """Assign a dense integer index to every gene appearing in the given gene sets.
+
+    :param gene_sets: gene sets, e.g., the genes in each pathway
+    :return: a mapping from gene identifier to bit position
+    """
+    rv: dict[str, int] = {}
+    for gene_set in gene_sets:
+        for gene in gene_set:
+            rv.setdefault(gene, len(rv))
+    return rv
+
+
+def _get_gene_bits(gene_set: Iterable[str], gene_to_idx: dict[str, int]) -> np.ndarray:
+    """Pack a gene set into a bitmask of 64-bit words.
+
+    :param gene_set: the genes to set bits for. Genes missing from the index
+        are skipped.
+    :param gene_to_idx: a mapping from gene identifier to bit position
+    :return: a uint64 array with one bit per gene in the index
+    """
+    rv = np.zeros(-(-len(gene_to_idx) // 64), dtype=np.uint64)
+    idx = np.fromiter(
+        (gene_to_idx[gene] for gene in gene_set if gene in gene_to_idx), dtype=np.uint64
+    )
+    np.bitwise_or.at(rv, idx >> np.uint64(6), np.uint64(1) << (idx & np.uint64(63)))
+    return rv
+
+
+@njit(cache=True)
+def _popcount(x: np.uint64) -> np.uint64:
+    """Count the set bits in a 64-bit word (LLVM lowers this to ``POPCNT``)."""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+@njit(cache=True)
+def _log_binom(n: int, k: int) -> float:
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+
+@njit(cache=True)
+def _hypergeom_logsf(k: int, gene_universe: int, pathway_size: int, query_size: int) -> float:
+    """Calculate the log probability of drawing at least ``k`` pathway genes.
+
+    This is the log of ``scipy.stats.hypergeom.sf(k - 1, M, n, N)``, i.e., the
+    one-sided ("greater") Fisher's exact test p-value for the 2x2 table
+    ``[[k, N - k], [n - k, M - N - n + k]]``.
+    """
+    low = max(k, query_size + pathway_size - gene_universe, 0)
+    high = min(query_size, pathway_size)
+    if low > high:
+        return -math.inf
+    log_total = _log_binom(gene_universe, query_size)
+    log_max = -math.inf
+    acc = 0.0
+    previous = -math.inf
+    for x in range(low, high + 1):
+        log_pmf = (
+            _log_binom(pathway_size, x)
+            + _log_binom(gene_universe - pathway_size, query_size - x)
+            - log_total
+        )
+        if log_pmf > log_max:
+            acc = acc * math.exp(log_max - log_pmf) + 1.0
+            log_max = log_pmf
+        else:
+            acc += math.exp(log_pmf - log_max)
+            # Past the mode the pmf only decreases, so the remaining terms are negligible
+            if log_pmf < previous and log_pmf < log_max - 40.0:
+                break
+        previous = log_pmf
+    return log_max + math.log(acc)
+
+
+@njit(parallel=True, cache=True)
+def _score_all(
+    pert_bits: np.ndarray,
+    pathway_bits: np.ndarray,
+    pathway_sizes: np.ndarray,
+    pert_sizes: np.ndarray,
     gene_universe: int,
-) -> np.ndarray:
-    """Prepare the matrix for hypergeometric test calculations.
+    out_log_p: np.ndarray,
+) -> None:
+    """Calculate one-sided Fisher's exact test log p-values for all perturbation-pathway pairs.
 
-    :param query_gene_set: gene set to test against pathway
-    :param pathway_gene_set: pathway gene set
+    Log p-values are returned since the p-values of strong enrichments
+    underflow to zero in floating point.
+
+    :param pert_bits: a matrix with one gene bitmask row per perturbation
+    :param pathway_bits: a matrix with one gene bitmask row per pathway
+    :param pathway_sizes: number of genes in each pathway
+    :param pert_sizes: number of genes in each perturbation
     :param gene_universe: number of HGNC symbols
-    :return: 2x2 matrix
+    :param out_log_p: a (perturbations x pathways) matrix the natural log
+        p-values are written into
     """
-    return np.array(
-        [
-            [
-                len(query_gene_set.intersection(pathway_gene_set)),
-                len(query_gene_set.difference(pathway_gene_set)),
-            ],
-            [
-                len(pathway_gene_set.difference(query_gene_set)),
-                gene_universe - len(pathway_gene_set.union(query_gene_set)),
-            ],
-        ]
-    )
+    n_perts, n_words = pert_bits.shape
+    n_pathways = pathway_bits.shape[0]
+    for i in prange(n_perts):
+        for j in range(n_pathways):
+            k = 0
+            for w in range(n_words):
+                k += _popcount(pert_bits[i, w] & pathway_bits[j, w])
+            log_p = _hypergeom_logsf(int(k), gene_universe, pathway_sizes[j], pert_sizes[i])
+            out_log_p[i, j] = min(0.0, log_p)
+
+
+def _fdr_bh_log(log_p: np.ndarray) -> np.ndarray:
+    """Apply the Benjamini-Hochberg correction to each row of a matrix of log p-values.
+
+    This is the same as ``multipletests(p, method="fdr_bh")`` applied to each
+    row, but done in log space so that q-values stay meaningful even when the
+    p-values underflow to zero.
+
+    :param log_p: a matrix of natural log p-values
+    :return: a matrix of natural log q-values of the same shape
+    """
+    n_tests = log_p.shape[-1]
+    order = np.argsort(log_p, axis=-1)
+    log_q = np.take_along_axis(log_p, order, axis=-1)
+    log_q += np.log(n_tests) - np.log(np.arange(1, n_tests + 1))
+    # Enforce monotonicity, starting from the largest p-value
+    log_q = np.minimum.accumulate(log_q[..., ::-1], axis=-1)[..., ::-1]
+    np.minimum(log_q, 0.0, out=log_q)
+    rv = np.empty_like(log_q)
+    np.put_along_axis(rv, order, log_q, axis=-1)
+    return rv
 
 
 def _main():
-    reactome_ids = get_reactome_human_ids()
-    reactome_it = [
-        (reactome_id, get_reactome_genes(reactome_id))
-        for reactome_id in tqdm(reactome_ids, desc="Downloading Reactome pathways")
-    ]
+    reactome_ids = sorted(get_reactome_human_ids())
+    # Downloading is I/O-bound, so overlap requests with a thread pool. The
+    # per-model progress bars are disabled meanwhile so that concurrent
+    # workers don't garble the overall progress bar.
+    tqdm_disable = pybiopax.PYBIOPAX_TQDM_CONFIG.get("disable")
+    pybiopax.PYBIOPAX_TQDM_CONFIG["disable"] = True
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            reactome_it = list(
+                zip(
+                    reactome_ids,
+                    tqdm(
+                        executor.map(get_reactome_genes, reactome_ids),
+                        total=len(reactome_ids),
+                        desc="Downloading Reactome pathways",
+                    ),
+                )
+            )
+    finally:
+        if tqdm_disable is None:
+            del pybiopax.PYBIOPAX_TQDM_CONFIG["disable"]
+        else:
+            pybiopax.PYBIOPAX_TQDM_CONFIG["disable"] = tqdm_disable
+    pathway_curies = [f"reactome:{reactome_id}" for reactome_id, _ in reactome_it]
+    pathway_sizes = np.array([len(reactome_genes) for _, reactome_genes in reactome_it])
+    # Only genes in some pathway can contribute to an intersection, so only
+    # they need a bit. The other cells of each 2x2 table are derived from the
+    # intersection, the set sizes, and the universe size.
+    gene_to_idx = _get_gene_index(reactome_genes for _, reactome_genes in reactome_it)
+    pathway_bits = np.ascontiguousarray(
+        [_get_gene_bits(reactome_genes, gene_to_idx) for _, reactome_genes in reactome_it]
+    )
 
     universe_size = len(pyobo.get_ids("hgnc"))
     groups = [
@@ -195,29 +378,78 @@ def _main():
         tqdm.write(f"generating CREEDS types {entity_type}")
         stmts = get_creeds_statements(entity_type)
         perts = f(stmts)
-        dfs = []
-        for pert_id, pert_genes in tqdm(perts.items()):
-            rows = []
-            for reactome_id, reactome_genes in tqdm(reactome_it, leave=False):
-                table = _prepare_hypergeometric_test(pert_genes, reactome_genes, universe_size)
-                _, p_value = fisher_exact(table, alternative="greater")
-                rows.append((f"{prefix}:{pert_id}", f"reactome:{reactome_id}", p_value))
-            df = pd.DataFrame(rows, columns=["perturbation", "pathway", "p"])
-            correction_test = multipletests(df["p"], method="fdr_bh")
-            df["q"] = correction_test[1]
-            df["mlq"] = -np.log10(df["q"])  # minus log q
-            df.sort_values("q", inplace=True)
-            dfs.append(df)
-
+        if not perts:
+            tqdm.write(f"no CREEDS {entity_type} perturbations to score")
+            continue
+        pert_ids = list(perts)
+        pert_bits = np.ascontiguousarray(
+            [_get_gene_bits(perts[pert_id], gene_to_idx) for pert_id in pert_ids]
+        )
+        pert_sizes = np.array([len(perts[pert_id]) for pert_id in pert_ids])
+        log_p_values = np.empty((len(pert_ids), len(pathway_curies)))
+        _score_all(pert_bits, pathway_bits, pathway_sizes, pert_sizes, universe_size, log_p_values)
+        log_q_values = _fdr_bh_log(log_p_values)
+        # Minus log q is derived from log q directly, so it stays finite even
+        # when q underflows to zero
+        mlq_values = -log_q_values / np.log(10)
+
+        pert_curies = [f"{prefix}:{pert_id}" for pert_id in pert_ids]
+        df = pd.DataFrame(
+            {
+                # a categorical keeps the perturbations in their original order when sorting
+                "perturbation": pd.Categorical(
+                    np.repeat(pert_curies, len(pathway_curies)), categories=pert_curies
+                ),
+                "pathway": np.tile(pathway_curies, len(pert_curies)),
+                "p": np.exp(log_p_values).ravel(),
+                "q": np.exp(log_q_values).ravel(),
+                "mlq": mlq_values.ravel(),  # minus log q
+            }
+        )
+        # Sort by minus log q since q-values of strong enrichments can tie at zero
+        df.sort_values(
+            ["perturbation", "mlq"], ascending=[True, False], inplace=True, kind="stable"
+        )
+
+        # The TSV is what downstream notebooks read, so it is always written
         path = CREEDS_MODULE.join(name=f"{entity_type}.tsv")
-        df = pd.concat(dfs)
-        df.to_csv(path, sep="\t", index=False)
+        if pyarrow is None:
+            logger.info("pyarrow is not installed, writing TSV with pandas and skipping Parquet")
+            df.to_csv(path, sep="\t", index=False)
+        else:
+            # pyarrow's multithreaded writer is much faster than formatting rows in pandas
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            pyarrow.csv.write_csv(
+                table, path, write_options=pyarrow.csv.WriteOptions(delimiter="\t")
+            )
+            parquet_path = CREEDS_MODULE.join(name=f"{entity_type}.parquet")
+            pyarrow.parquet.write_table(table, parquet_path, compression="zstd")
+            print("output to", parquet_path)
         print("output to", path)
 
-        # TODO: cut off genes that don't have anything good going on
-        square_df = df.pivot(columns="pathway", index="perturbation")["mlq"]
+        # Clustering is super-linear, so cut off perturbations and pathways
+        # that don't have a single significant enrichment
+        mlq_cutoff = -np.log10(0.05)
+        row_mask = mlq_values.max(axis=1) > mlq_cutoff
+        col_mask = mlq_values.max(axis=0) > mlq_cutoff
+        # float32 halves the memory of the heatmap data; scipy's linkage
+        # upcasts to float64 internally regardless
+        values = np.ascontiguousarray(mlq_values[row_mask][:, col_mask], dtype=np.float32)
+        if min(values.shape) < 2:
+            tqdm.write(f"not enough significant {entity_type} enrichments to cluster")
+            continue
+        square_df = pd.DataFrame(
+            values,
+            index=pd.Index(np.array(pert_curies)[row_mask], name="perturbation"),
+            columns=pd.Index(np.array(pathway_curies)[col_mask], name="pathway"),
+        )
         img_path = CREEDS_MODULE.join(name=f"{entity_type}.png")
-        g = seaborn.clustermap(square_df)
+        g = seaborn.clustermap(
+            square_df,
+            row_linkage=linkage(values, method="average", metric="euclidean"),
+            col_linkage=linkage(values.T, method="average", metric="euclidean"),
+            robust=True,
+        )
         g.savefig(img_path)
 
 
@@ -1,4 +1,5 @@
-__all__ = ['model_from_owl_str', 'model_from_owl_file', 'model_to_owl_str',
+__all__ = ['model_from_owl_str', 'model_from_owl_stream', 'model_from_owl_file',
+           'model_to_owl_str',
            'model_to_owl_file', 'model_from_owl_url', 'model_from_pc_query',
            'model_from_reactome', 'model_from_ecocyc', 'model_from_metacyc',
            'model_from_biocyc', 'model_from_humancyc', 'model_from_netpath',
@@ -6,17 +7,41 @@ __all__ = ['model_from_owl_str', 'model_from_owl_file', 'model_to_owl_str',
            ]
 
 import gzip
+import io
 import os
 import pathlib
 
 import requests
 from lxml import etree
-from typing import Any, Mapping, Optional, Union
+from requests.adapters import HTTPAdapter
+from typing import Any, BinaryIO, Mapping, Optional, Union
+from urllib3.util.retry import Retry
 from .biopax.model import BioPaxModel, PYBIOPAX_TQDM_CONFIG
 from .xml_util import xml_to_str, xml_to_file
 from .pc_client import graph_query
 
 
+def _make_session() -> requests.Session:
+    """Return a session that keeps connections alive and retries transient
+    server errors, so that many downloads from the same host reuse
+    connections instead of paying for a new TCP/TLS handshake each time."""
+    retry = Retry(total=3, backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_session = _make_session()
+
+#: The number of bytes read at a time when parsing OWL content from a stream
+_CHUNK_SIZE = 1 << 20
+
+
 def model_from_owl_str(owl_str: str) -> BioPaxModel:
     """Return a BioPAX Model from an OWL string.
 
@@ -30,7 +55,41 @@ def model_from_owl_str(owl_str: str) -> BioPaxModel:
     pybiopax.biopax.BioPaxModel
         A BioPAX Model deserialized from the OWL string.
     """
-    return BioPaxModel.from_xml(etree.fromstring(owl_str.encode('utf-8')))
+    return model_from_owl_stream(io.BytesIO(owl_str.encode('utf-8')))
+
+
+def model_from_owl_stream(fileobj: BinaryIO,
+                          huge_tree: bool = False) -> BioPaxModel:
+    """Return a BioPAX Model from a binary file-like object of OWL content.
+
+    The content is parsed incrementally as it is read from the object, so
+    large OWL files (e.g., from a streamed HTTP response) never need to be
+    held in memory as a single string next to the parsed tree.
+
+    Parameters
+    ----------
+    fileobj :
+        A binary file-like object with OWL content of BioPAX, e.g., an open
+        file, a :class:`gzip.GzipFile`, or the raw stream of a
+        :mod:`requests` response.
+    huge_tree :
+        If True, disable libxml2's safety limits on tree depth and text
+        node size. Only enable this for trusted sources whose files are
+        known to exceed these limits (e.g., large Reactome pathways).
+        Default: False
+
+    Returns
+    -------
+    :
+        A BioPAX Model deserialized from the OWL content.
+    """
+    # Parsers can't be shared across threads, so make a new one each time
+    parser = etree.XMLParser(huge_tree=huge_tree, collect_ids=False)
+    # Feed the parser chunks rather than using etree.parse, which would take
+    # the document URL from the file object and use it as the model's base
+    for chunk in iter(lambda: fileobj.read(_CHUNK_SIZE), b''):
+        parser.feed(chunk)
+    return BioPaxModel.from_xml(parser.close())
 
 
 def model_from_owl_file(fname: Union[str, pathlib.Path, os.PathLike],
@@ -92,11 +151,13 @@ def model_from_owl_gz_str(owl_gz_str: bytes) -> BioPaxModel:
     pybiopax.biopax.BioPaxModel
         A BioPAX Model deserialized from the OWL string.
     """
-    return model_from_owl_str(gzip.decompress(owl_gz_str).decode('utf-8'))
+    with gzip.GzipFile(fileobj=io.BytesIO(owl_gz_str)) as fh:
+        return model_from_owl_stream(fh)
 
 
 def model_from_owl_url(url: str,
-                       request_params: Optional[Mapping[str, Any]] = None) \
+                       request_params: Optional[Mapping[str, Any]] = None,
+                       huge_tree: bool = False) \
         -> BioPaxModel:
     """Return a BioPAX Model from an URL pointing to an OWL file.
 
@@ -105,20 +166,28 @@ def model_from_owl_url(url: str,
     url :
         A OWL URL with BioPAX content.
     request_params :
-        Additional keyword arguments to pass to :func:`requests.get`
+        Additional keyword arguments to pass to :meth:`requests.Session.get`
+    huge_tree :
+        If True, disable libxml2's safety limits on tree depth and text
+        node size while parsing. See :func:`model_from_owl_stream`.
+        Default: False
 
     Returns
     -------
     :
         A BioPAX Model deserialized from the OWL file.
     """
-    request_params = {} if not request_params else request_params
-    res = requests.get(url, **request_params)
-    res.raise_for_status()
-    if url.endswith('gz'):
-        return model_from_owl_gz_str(res.content)
-    else:
-        return model_from_owl_str(res.text)
+    # The response is always streamed into the parser
+    request_params = {**(request_params or {}), 'stream': True}
+    with _session.get(url, **request_params) as res:
+        res.raise_for_status()
+        # Undo any Content-Encoding (e.g., gzip transfer compression)
+        res.raw.decode_content = True
+        if url.endswith('gz'):
+            with gzip.GzipFile(fileobj=res.raw) as fh:
+                return model_from_owl_stream(fh, huge_tree=huge_tree)
+        else:
+            return model_from_owl_stream(res.raw, huge_tree=huge_tree)
 
 
 def model_from_pc_query(kind, source, target=None, **query_params):
@@ -200,7 +269,8 @@ def model_from_reactome(identifier: str) -> BioPaxModel:
         identifier = identifier[len("R-HSA-"):]
     url = f"https://reactome.org/ReactomeRESTfulAPI/RESTfulWS/biopaxExporter/" \
           f"Level3/{identifier}"
-    return model_from_owl_url(url)
+    # Some Reactome pathways exceed libxml2's default size limits
+    return model_from_owl_url(url, huge_tree=True)
 
 
 def model_from_humancyc(identifier: str) -> BioPaxModel:
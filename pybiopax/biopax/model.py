@@ -1,6 +1,6 @@
 __all__ = ['BioPaxModel', 'PYBIOPAX_TQDM_CONFIG']
 
-from typing import Any, Mapping, Optional
+from typing import Any, Iterator, Mapping, Optional
 
 from tqdm.auto import tqdm
 
@@ -95,7 +95,24 @@ class BioPaxModel:
                                                  **tqdm_kwargs)]
         return wrap_xml_elements(elements, self.xml_base)
 
-    def get_objects_by_type(self, obj_type):
+    def get_objects_by_type(self, obj_type) -> Iterator[BioPaxObject]:
+        """Iterate over the objects in the model of a given type.
+
+        Objects are yielded lazily during a single pass over the model's
+        objects, so no intermediate list is built. Wrap the result in
+        :func:`list` if the objects need to be traversed more than once.
+
+        Parameters
+        ----------
+        obj_type :
+            A BioPAX class, e.g., :class:`pybiopax.biopax.Protein`. Objects
+            of any of its subclasses are also yielded.
+
+        Returns
+        -------
+        :
+            An iterator over the objects in the model of the given type.
+        """
         for obj in self.objects.values():
             if isinstance(obj, obj_type):
                 yield obj
@@ -17,8 +17,7 @@ def get_prefix_id_pairs(model: BioPaxModel) -> List[Tuple[str, str]]:
     :
         A list of database/identifier pairs used in the model.
     """
-    refs = list(model.get_objects_by_type(Xref))
-    return [(ref.db, ref.id) for ref in refs]
+    return [(ref.db, ref.id) for ref in model.get_objects_by_type(Xref)]
 
 
 def get_all_prefixes(model: BioPaxModel) -> Set[str]:
@@ -34,7 +33,7 @@ def get_all_prefixes(model: BioPaxModel) -> Set[str]:
     :
         A set of all prefixes used in the model.
     """
-    return {db for db, identifier in get_prefix_id_pairs(model)}
+    return {ref.db for ref in model.get_objects_by_type(Xref)}
 
 
 def get_prefix_statistics(model: BioPaxModel) -> Mapping[str, int]:
@@ -52,7 +51,7 @@ def get_prefix_statistics(model: BioPaxModel) -> Mapping[str, int]:
         A dict of prefixes and the number of times they are used
         in references in the model.
      """
-    return dict(Counter([db for db, identifier
-                         in get_prefix_id_pairs(model)]).most_common())
+    return dict(Counter(ref.db for ref
+                        in model.get_objects_by_type(Xref)).most_common())
 
 
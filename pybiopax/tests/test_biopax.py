@@ -1,5 +1,8 @@
+import gzip
+import io
 import os
 import re
+import tempfile
 import pybiopax
 from pybiopax.biopax import *
 
@@ -53,6 +56,83 @@ def test_process_molecular_interactions():
     assert len(model.objects) == 62
 
 
+def test_process_owl_stream():
+    test_file = os.path.join(here, 'molecular_interactions_test.owl')
+    with open(test_file, 'rb') as fh:
+        model = pybiopax.model_from_owl_stream(fh)
+    assert len(model.objects) == 62
+
+    test_file = os.path.join(here, 'biopax_test.owl.gz')
+    with open(test_file, 'rb') as fh:
+        model = pybiopax.api.model_from_owl_gz_str(fh.read())
+    assert len(model.objects) == 58027, len(model.objects)
+
+
+def test_process_owl_stream_no_base():
+    test_file = os.path.join(here, 'molecular_interactions_test.owl')
+    with open(test_file, 'rb') as fh:
+        owl_bytes = fh.read().replace(
+            b' xml:base="http://pathwaycommons.org/pc12/"', b'')
+    assert b'xml:base' not in owl_bytes
+    # The model's base must not be taken from the file's name or location
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'no_base.owl')
+        with open(path, 'wb') as fh:
+            fh.write(owl_bytes)
+        with open(path, 'rb') as fh:
+            model = pybiopax.model_from_owl_stream(fh)
+    assert len(model.objects) == 62
+    assert model.xml_base is None
+
+    model = pybiopax.api.model_from_owl_gz_str(gzip.compress(owl_bytes))
+    assert len(model.objects) == 62
+    assert model.xml_base is None
+
+
+def test_process_owl_url(monkeypatch):
+    test_file = os.path.join(here, 'biopax_test.owl.gz')
+    with open(test_file, 'rb') as fh:
+        content = fh.read()
+    requested = {}
+
+    class FakeResponse:
+        raw = io.BytesIO(content)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def raise_for_status(self):
+            pass
+
+    def fake_get(url, **kwargs):
+        requested.update(kwargs, url=url)
+        return FakeResponse()
+
+    monkeypatch.setattr(pybiopax.api._session, 'get', fake_get)
+    # Passing stream explicitly must not clash with the streamed download
+    model = pybiopax.model_from_owl_url('http://example.org/test.owl.gz',
+                                        request_params={'stream': False})
+    assert len(model.objects) == 58027, len(model.objects)
+    assert requested == {'url': 'http://example.org/test.owl.gz',
+                         'stream': True}
+
+
+def test_get_objects_by_type():
+    test_file = os.path.join(here, 'molecular_interactions_test.owl')
+    model = pybiopax.model_from_owl_file(test_file)
+    proteins = model.get_objects_by_type(Protein)
+    # Objects are yielded lazily rather than collected into a list
+    assert not isinstance(proteins, list)
+    proteins = list(proteins)
+    assert proteins
+    assert all(isinstance(protein, Protein) for protein in proteins)
+    assert len(proteins) == sum(isinstance(obj, Protein)
+                                for obj in model.objects.values())
+
+
 def test_get_netpath():
     m = pybiopax.model_from_netpath("22")
     assert isinstance(m, BioPaxModel)